@@ -5,14 +5,10 @@ Punto de entrada del programa - Fases 1, 2 y 3: Gestión de usuarios, tickets y
 from core.auth import register_user, login_user
 from core.logger import log_action
 from core.validation import input_int_in_range, input_password, safe_input
-from core.tickets import (
-    create_ticket,
-    list_tickets,
-    view_ticket_detail,
-    update_ticket,
-    delete_ticket,
-)
-from core.safety_demo import run_safety_demo
+
+# Los módulos de tickets y de la demo de seguridad se importan dentro de
+# cada opción del menú: quien solo se registra o sale no paga su carga.
+# Python guarda los módulos ya importados, así que repetir el import es gratis.
 
 
 def main_menu_not_logged():
@@ -136,26 +132,32 @@ def main():
                 
                 elif option == 1:
                     # Crear ticket
+                    from core.tickets import create_ticket
                     create_ticket(current_user)
                 
                 elif option == 2:
                     # Ver lista de tickets
+                    from core.tickets import list_tickets
                     list_tickets(current_user)
                 
                 elif option == 3:
                     # Ver detalle de un ticket
+                    from core.tickets import view_ticket_detail
                     view_ticket_detail(current_user)
                 
                 elif option == 4:
                     # Editar un ticket
+                    from core.tickets import update_ticket
                     update_ticket(current_user)
                 
                 elif option == 5:
                     # Eliminar ticket
+                    from core.tickets import delete_ticket
                     delete_ticket(current_user)
                 
                 elif option == 6:
                     # Demostración de seguridad (Fase 3)
+                    from core.safety_demo import run_safety_demo
                     run_safety_demo(current_user)
                 
                 elif option == 7:
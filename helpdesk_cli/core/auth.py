@@ -2,78 +2,242 @@
 Módulo de autenticación para registrar e iniciar sesión de usuarios.
 Maneja toda la lógica relacionada con usuarios.
 """
+import hashlib
+import hmac
 import os
-from datetime import datetime
+import time
+from collections import OrderedDict
+from dataclasses import replace
 
-from .security import hash_password, verify_password
-from .storage import DATA_DIR, read_json_lines, write_json_lines
+from .security import hash_password, needs_rehash, verify_password
+from .storage import DATA_DIR, append_json_line, file_lock, iter_json_lines, write_json_lines
+from .timeutil import now_iso_z
 from .validation import is_valid_username, is_valid_password, is_valid_role
 from models.user import User
 
 # Ruta del archivo donde se guardan los usuarios
 USERS_FILE = os.path.join(DATA_DIR, "users.txt")
 
+# Tabla de usuarios en memoria (username -> User) y el ID más alto en uso.
+# Se carga una sola vez y se recarga solo si el archivo cambia en disco.
+_USERS_BY_NAME: dict[str, User] | None = None
+_MAX_ID: int = 0
+_USERS_STAMP: tuple[int, int] | None = None
 
-def _load_users() -> list[User]:
+# El archivo de usuarios es de solo agregar: un registro {"id": ..., "_deleted": true}
+# marca como eliminado ese ID. Si más del 30% de los registros están muertos
+# (eliminados o reemplazados) se reescribe el archivo completo en la siguiente
+# escritura, con el archivo bloqueado para no perder registros de otro proceso.
+COMPACT_RATIO = 0.3
+
+# Registros totales y muertos del archivo en la última carga
+_USERS_TOTAL: int = 0
+_USERS_DEAD: int = 0
+
+# Campos que no pueden faltar ni estar vacíos en un registro de usuario
+_REQUIRED_USER_FIELDS = ("id", "username", "password_hash")
+
+# Caché de logins recientes para no repetir scrypt en cada inicio de sesión.
+# Una entrada vence a las 3 horas de creada o tras 1 hora sin usarse, y se
+# conserva al cerrar sesión: volver a entrar después de un logout es justo el
+# caso que aprovecha. Si se llena, se descarta la usada hace más tiempo (LRU).
+LOGIN_CACHE_TTL = 3 * 60 * 60
+LOGIN_CACHE_IDLE = 60 * 60
+LOGIN_CACHE_MAX = 1024
+
+# Clave aleatoria del proceso: la caché nunca guarda la contraseña en claro
+_LOGIN_CACHE_KEY = os.urandom(32)
+
+# username -> (password_hash, verificador, creado, último uso)
+_login_cache: OrderedDict[str, tuple[str, bytes, float, float]] = OrderedDict()
+
+
+def _load_users() -> tuple[list[User], list[str], int]:
     """
     Carga todos los usuarios desde el archivo.
     Ignora registros que estén incompletos o con errores.
+    Si un ID aparece varias veces gana el último registro, y las
+    lápidas (_deleted) eliminan el usuario con ese ID.
+    Devuelve los usuarios vigentes, los IDs eliminados y la cantidad
+    total de registros del archivo.
     """
-    records = read_json_lines(USERS_FILE)
-    users = []
-    
-    for record in records:
-        try:
-            user = User.from_dict(record)
-            # Verificar que los campos obligatorios no estén vacíos
-            if user.id and user.username and user.password_hash:
-                users.append(user)
-        except Exception:
-            # Si hay algún problema al crear el User, ignorarlo
+    users_by_id: dict[str, User] = {}
+    deleted_ids: dict[str, None] = {}
+    total = 0
+    
+    for record in iter_json_lines(USERS_FILE):
+        total += 1
+        # Lápida: el usuario con este ID fue eliminado
+        if record.get("_deleted"):
+            record_id = str(record.get("id", ""))
+            users_by_id.pop(record_id, None)
+            deleted_ids[record_id] = None
             continue
+        # Verificar que los campos obligatorios no estén vacíos
+        # antes de crear el User (más barato que capturar excepciones)
+        if not all(record.get(field) for field in _REQUIRED_USER_FIELDS):
+            continue
+        user = User.from_dict(record)
+        users_by_id[user.id] = user
+        deleted_ids.pop(user.id, None)
     
-    return users
+    return list(users_by_id.values()), list(deleted_ids), total
 
 
-def _save_users(users: list[User]) -> None:
+def _append_user(user: User) -> None:
     """
-    Guarda la lista completa de usuarios al archivo.
+    Agrega un usuario al final del archivo sin reescribir los demás.
+    """
+    append_json_line(USERS_FILE, user.to_dict())
+
+
+def _rewrite_users(users: list[User], deleted_ids: list[str]) -> None:
+    """
+    Guarda la lista completa de usuarios al archivo, más una lápida
+    por cada ID eliminado (sus IDs nunca se vuelven a asignar).
+    Solo se usa al compactar, porque reescribe todos los registros.
     """
     records = [user.to_dict() for user in users]
-    write_json_lines(USERS_FILE, records)
+    records += [{"id": user_id, "_deleted": True} for user_id in deleted_ids]
+    # Perder el archivo de usuarios sería grave, así que se fuerza fsync
+    write_json_lines(USERS_FILE, records, fsync=True)
+
+
+def compact_users() -> None:
+    """
+    Reescribe el archivo de usuarios dejando solo los registros vigentes.
+    Lee y reescribe con el archivo bloqueado: así no se pierde un registro
+    que otro proceso agregue entre la lectura y la escritura.
+    """
+    with file_lock(USERS_FILE):
+        users, deleted_ids, _ = _load_users()
+        _rewrite_users(users, deleted_ids)
+        reload_users()
+
+
+def _users_need_compaction() -> bool:
+    """
+    Indica si el archivo, según la última carga, tiene demasiados
+    registros muertos.
+    """
+    return _USERS_TOTAL > 0 and _USERS_DEAD / _USERS_TOTAL > COMPACT_RATIO
+
+
+def _users_file_stamp() -> tuple[int, int] | None:
+    """
+    Devuelve la fecha de modificación (en nanosegundos) y el tamaño del
+    archivo de usuarios, o None si todavía no existe. Un solo stat() basta
+    para saber si alguien lo modificó desde la última carga.
+    """
+    try:
+        st = os.stat(USERS_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
 
 
-def _next_user_id(users: list[User]) -> str:
+def _users_cache_is_fresh() -> bool:
+    """
+    Indica si la tabla en memoria está cargada y el archivo no cambió.
+    """
+    return _USERS_BY_NAME is not None and _users_file_stamp() == _USERS_STAMP
+
+
+def _load_users_cached() -> dict[str, User]:
+    """
+    Devuelve la tabla de usuarios en memoria indexada por username.
+    Solo vuelve a leer el archivo si cambió desde la última carga.
+    """
+    global _USERS_BY_NAME, _MAX_ID, _USERS_STAMP, _USERS_TOTAL, _USERS_DEAD
+    
+    if _users_cache_is_fresh():
+        return _USERS_BY_NAME
+    
+    stamp = _users_file_stamp()
+    
+    users, deleted_ids, total = _load_users()
+    _USERS_BY_NAME = {user.username: user for user in users}
+    _USERS_TOTAL = total
+    _USERS_DEAD = total - len(users) - len(deleted_ids)
+    
+    # Guardar el ID más alto (incluidos los eliminados, que no se reutilizan)
+    # para asignar el siguiente sin recorrer la lista.
+    # Los IDs que no son números se ignoran (isdecimal garantiza que int() funcione).
+    all_ids = [user.id for user in users] + deleted_ids
+    _MAX_ID = max((int(user_id) for user_id in all_ids if user_id.isdecimal()), default=0)
+    _USERS_STAMP = stamp
+    
+    return _USERS_BY_NAME
+
+
+def reload_users() -> None:
+    """
+    Descarta la tabla de usuarios en memoria.
+    La siguiente operación volverá a leer el archivo completo.
+    """
+    global _USERS_BY_NAME, _MAX_ID, _USERS_STAMP, _USERS_TOTAL, _USERS_DEAD
+    _USERS_BY_NAME = None
+    _MAX_ID = 0
+    _USERS_STAMP = None
+    _USERS_TOTAL = 0
+    _USERS_DEAD = 0
+
+
+def _next_user_id() -> str:
     """
     Calcula el siguiente ID disponible para un nuevo usuario.
     Si no hay usuarios, devuelve "1".
     """
-    if not users:
-        return "1"
-    
-    # Buscar el ID más alto y sumarle 1
-    max_id = 0
-    for user in users:
-        try:
-            user_id_int = int(user.id)
-            if user_id_int > max_id:
-                max_id = user_id_int
-        except ValueError:
-            # Si el ID no es un número, ignorarlo
-            continue
-    
-    return str(max_id + 1)
+    _load_users_cached()
+    return str(_MAX_ID + 1)
 
 
-def find_user_by_username(username: str, users: list[User]) -> User | None:
+def find_user_by_username(username: str) -> User | None:
     """
     Busca un usuario por su nombre de usuario.
     Devuelve None si no lo encuentra.
     """
-    for user in users:
-        if user.username == username:
-            return user
-    return None
+    return _load_users_cached().get(username)
+
+
+def find_user_record(username: str, path: str = USERS_FILE) -> User | None:
+    """
+    Busca un usuario recorriendo el archivo una sola vez, sin construir
+    la tabla completa: solo se crea el User de los registros que coinciden.
+    Respeta las mismas reglas que _load_users (gana el último registro de
+    cada ID y las lápidas eliminan).
+    """
+    found = None
+    
+    for record in iter_json_lines(path):
+        if record.get("_deleted") or record.get("username") != username:
+            # Un registro posterior con el mismo ID reemplaza o elimina al encontrado
+            if found is not None and str(record.get("id", "")) == found.id:
+                found = None
+            continue
+        if all(record.get(field) for field in _REQUIRED_USER_FIELDS):
+            found = User.from_dict(record)
+    
+    return found
+
+
+def _password_token(password: str) -> bytes:
+    """
+    Calcula un verificador barato (HMAC) de la contraseña para la caché.
+    Solo es válido dentro de este proceso porque la clave es aleatoria.
+    """
+    return hmac.new(_LOGIN_CACHE_KEY, password.encode("utf-8"), hashlib.sha256).digest()
+
+
+def invalidate_login_cache(username: str | None = None) -> None:
+    """
+    Elimina de la caché de logins un usuario o, si no se indica, todos.
+    Debe llamarse cuando cambia la contraseña o se elimina el usuario.
+    """
+    if username is None:
+        _login_cache.clear()
+    else:
+        _login_cache.pop(username, None)
 
 
 def register_user(username: str, password: str, role: str) -> User | None:
@@ -82,6 +246,8 @@ def register_user(username: str, password: str, role: str) -> User | None:
     Valida todos los datos antes de guardar.
     Devuelve el usuario creado o None si hay algún error.
     """
+    global _MAX_ID, _USERS_STAMP, _USERS_TOTAL
+    
     # Validar username
     if not is_valid_username(username):
         print("Error: El nombre de usuario no es válido. Debe tener entre 3 y 30 caracteres y solo letras, números, puntos o guiones bajos.")
@@ -97,46 +263,119 @@ def register_user(username: str, password: str, role: str) -> User | None:
         print("Error: El rol debe ser 'user' o 'agent'.")
         return None
     
-    # Cargar usuarios existentes
-    users = _load_users()
-    
-    # Verificar que el username no esté en uso
-    if find_user_by_username(username, users):
+    # Verificar que el username no esté en uso (antes de pagar scrypt)
+    if find_user_by_username(username):
         print(f"Error: El nombre de usuario '{username}' ya está registrado.")
         return None
     
-    # Crear el nuevo usuario
-    now = datetime.utcnow().isoformat() + "Z"
-    new_user = User(
-        id=_next_user_id(users),
-        username=username,
-        password_hash=hash_password(password),
-        role=role,
-        created_at=now,
-        updated_at=now,
-    )
-    
-    # Agregar a la lista y guardar
-    users.append(new_user)
-    _save_users(users)
+    # scrypt tarda decenas de milisegundos: se calcula antes de bloquear
+    # el archivo para no hacer esperar a otros procesos
+    password_hash = hash_password(password)
+    
+    with file_lock(USERS_FILE):
+        # Con el archivo bloqueado se relee lo que otro proceso haya agregado,
+        # y se vuelve a comprobar el username antes de elegir el ID
+        if username in _load_users_cached():
+            print(f"Error: El nombre de usuario '{username}' ya está registrado.")
+            return None
+        
+        if _users_need_compaction():
+            compact_users()
+        
+        # Crear el nuevo usuario
+        now = now_iso_z()
+        new_user = User(
+            id=_next_user_id(),
+            username=username,
+            password_hash=password_hash,
+            role=role,
+            created_at=now,
+            updated_at=now,
+        )
+        
+        # Agregar al final del archivo y a la tabla en memoria.
+        # Nadie más puede escribir mientras se tiene el bloqueo, así que se
+        # actualiza la marca del archivo y nuestra escritura no provoca una recarga.
+        _append_user(new_user)
+        _USERS_BY_NAME[username] = new_user
+        _MAX_ID += 1
+        _USERS_TOTAL += 1
+        _USERS_STAMP = _users_file_stamp()
     
     return new_user
 
 
+def _upgrade_password_hash(user: User, password: str) -> User:
+    """
+    Reemplaza el hash SHA-256 antiguo de un usuario por uno scrypt.
+    Como el archivo es de solo agregar y gana el último registro de cada ID,
+    basta con agregar el usuario con el hash nuevo.
+    Si otro proceso cambió o eliminó al usuario mientras tanto, no hace nada.
+    Devuelve el usuario vigente.
+    """
+    global _USERS_STAMP, _USERS_TOTAL, _USERS_DEAD
+    
+    # scrypt se calcula antes de bloquear el archivo
+    new_hash = hash_password(password)
+    
+    with file_lock(USERS_FILE):
+        current = _load_users_cached().get(user.username)
+        if current is None or current.id != user.id or current.password_hash != user.password_hash:
+            return user
+        
+        upgraded = replace(user, password_hash=new_hash, updated_at=now_iso_z())
+        _append_user(upgraded)
+        _USERS_BY_NAME[user.username] = upgraded
+        # El registro anterior de este ID queda muerto
+        _USERS_TOTAL += 1
+        _USERS_DEAD += 1
+        _USERS_STAMP = _users_file_stamp()
+    
+    return upgraded
+
+
 def login_user(username: str, password: str) -> User | None:
     """
     Intenta iniciar sesión con un username y password.
     Devuelve el usuario si las credenciales son correctas, None si no.
     """
-    users = _load_users()
-    user = find_user_by_username(username, users)
+    # Con la tabla ya cargada basta un lookup; si no, una sola pasada
+    # por el archivo evita construir todos los usuarios para buscar uno
+    if _users_cache_is_fresh():
+        user = find_user_by_username(username)
+    else:
+        user = find_user_record(username)
     
     # Si no existe el usuario, retornar None
     if not user:
+        invalidate_login_cache(username)
         return None
     
+    # Intentar primero con la caché para evitar recalcular scrypt
+    now = time.monotonic()
+    token = _password_token(password)
+    entry = _login_cache.get(username)
+    if entry is not None:
+        cached_hash, cached_token, created, last_used = entry
+        fresh = now - created < LOGIN_CACHE_TTL and now - last_used < LOGIN_CACHE_IDLE
+        # Si el hash guardado cambió, la entrada ya no sirve
+        if fresh and cached_hash == user.password_hash:
+            if not hmac.compare_digest(token, cached_token):
+                return None
+            _login_cache[username] = (cached_hash, cached_token, created, now)
+            _login_cache.move_to_end(username)
+            return user
+        invalidate_login_cache(username)
+    
     # Verificar la contraseña
     if not verify_password(password, user.password_hash):
         return None
     
+    # Los usuarios con el hash antiguo pasan a scrypt en este login
+    if needs_rehash(user.password_hash):
+        user = _upgrade_password_hash(user, password)
+    
+    _login_cache[username] = (user.password_hash, token, now, now)
+    if len(_login_cache) > LOGIN_CACHE_MAX:
+        _login_cache.popitem(last=False)
     return user
@@ -1,14 +1,86 @@
 """
 Módulo de auditoría para registrar las acciones importantes del sistema.
 Guarda logs en formato JSON para facilitar análisis posterior.
+La serialización y la escritura en disco se hacen en un hilo aparte
+(ThreadPoolExecutor de un solo hilo) para no bloquear el menú.
 """
+import atexit
 import os
-from datetime import datetime
-from .storage import LOGS_DIR, append_json_line
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+from .storage import LOGS_DIR, append_json_lines, encode_json_line, iter_json_lines
+from .timeutil import now_iso_z
 
 # Archivo donde se guardan los logs de auditoría
 AUDIT_LOG_FILE = os.path.join(LOGS_DIR, "audit.log")
 
+# Parámetros del escritor en segundo plano
+LOG_MAX_PENDING = 10000     # Registros pendientes como máximo
+LOG_PUT_TIMEOUT = 1.0       # Espera máxima si hay demasiados pendientes
+
+# Tamaño máximo del campo details, en bytes UTF-8
+DETAILS_MAX_BYTES = 200
+
+# Un solo hilo garantiza que los registros se escriben en orden
+_LOG_EXEC = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit")
+
+# Limita los registros pendientes: si se llena, log_action espera (back-pressure)
+_PENDING = threading.BoundedSemaphore(LOG_MAX_PENDING)
+
+# Registros esperando a ser escritos y si ya hay una escritura programada.
+# Lo que llega mientras el hilo escribe se junta en el siguiente lote.
+_buffer: list[dict] = []
+_buffer_lock = threading.Lock()
+_write_scheduled = False
+
+
+def _write_records(records: list[dict]) -> None:
+    """
+    Agrega los registros al log de auditoría con una sola escritura,
+    siempre a través del escritor con bloqueo de storage.
+    Si falla, el error y los registros se muestran en stderr: un registro
+    de auditoría nunca debe perderse en silencio.
+    """
+    try:
+        append_json_lines(AUDIT_LOG_FILE, records)
+    except Exception as error:
+        print(f"[auditoría] No se pudo escribir en {AUDIT_LOG_FILE}: {error}", file=sys.stderr)
+        for record in records:
+            print(encode_json_line(record).decode("utf-8"), file=sys.stderr)
+
+
+def _write_log() -> None:
+    """
+    Escribe todos los registros pendientes con una sola llamada a write().
+    Se ejecuta en el hilo de auditoría.
+    """
+    global _write_scheduled
+    
+    with _buffer_lock:
+        batch = _buffer[:]
+        _buffer.clear()
+        _write_scheduled = False
+    
+    try:
+        if batch:
+            _write_records(batch)
+    finally:
+        for _ in batch:
+            _PENDING.release()
+
+
+def _shutdown() -> None:
+    """
+    Espera a que se escriban los registros pendientes.
+    Se ejecuta automáticamente al salir del programa.
+    """
+    _LOG_EXEC.shutdown(wait=True)
+
+
+atexit.register(_shutdown)
+
 
 def log_action(
     user,
@@ -27,8 +99,10 @@ def log_action(
     - entity: Tipo de entidad afectada (ej: user, ticket)
     - entity_id: ID de la entidad
     - status: success o failed
-    - details: Información adicional (máximo 200 caracteres)
+    - details: Información adicional (máximo 200 bytes en UTF-8)
     """
+    global _write_scheduled
+    
     # Extraer información del usuario si existe
     if user is not None:
         user_id = user.id
@@ -39,13 +113,18 @@ def log_action(
         role = "unknown"
         username = "unknown"
     
-    # Truncar los detalles si son muy largos
-    if len(details) > 200:
-        details = details[:200]
+    # Truncar los detalles si son muy largos. Se mide en bytes porque un
+    # carácter como "ñ" ocupa más de uno; cada carácter ocupa como mucho 4,
+    # así que los textos cortos no necesitan codificarse para comprobarlo.
+    if len(details) * 4 > DETAILS_MAX_BYTES:
+        encoded = details.encode("utf-8")
+        if len(encoded) > DETAILS_MAX_BYTES:
+            # errors="ignore" descarta un carácter que haya quedado cortado
+            details = encoded[:DETAILS_MAX_BYTES].decode("utf-8", errors="ignore")
     
     # Crear el registro de log
     log_record = {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "timestamp": now_iso_z(),
         "user_id": user_id,
         "username": username,
         "role": role,
@@ -56,6 +135,29 @@ def log_action(
         "details": details,
     }
     
-    # Guardar en el archivo de logs
+    # Pasar el registro al hilo de escritura
     # Nunca incluir contraseñas ni hashes aquí
-    append_json_line(AUDIT_LOG_FILE, log_record)
+    if _PENDING.acquire(timeout=LOG_PUT_TIMEOUT):
+        with _buffer_lock:
+            _buffer.append(log_record)
+            if _write_scheduled:
+                # Ya hay una escritura programada que se llevará este registro
+                return
+            _write_scheduled = True
+        try:
+            _LOG_EXEC.submit(_write_log)
+        except RuntimeError:
+            # El programa está terminando: escribir en este mismo hilo
+            _write_log()
+        return
+    
+    # Si el hilo no da abasto, escribir directamente para no perder el registro
+    _write_records([log_record])
+
+
+def read_audit(path: str = AUDIT_LOG_FILE) -> Iterator[dict]:
+    """
+    Recorre los registros del log de auditoría uno a uno,
+    sin cargar todo el archivo en memoria. Útil para análisis posteriores.
+    """
+    return iter_json_lines(path)
@@ -3,6 +3,7 @@ Módulo de demostración de seguridad.
 Muestra cómo se previenen errores de overflow/underflow lógico
 y otros problemas comunes mediante validaciones.
 """
+import json
 from typing import List
 from .validation import input_int_in_range
 from .logger import log_action
@@ -10,6 +11,9 @@ from .logger import log_action
 # Límite máximo de tickets permitidos en el sistema (ejemplo de límite de negocio)
 MAX_TICKETS_ALLOWED = 100000
 
+# Máximo de demostraciones que se anotan por sesión en el log de auditoría
+MAX_DEMO_EVENTS = 40
+
 
 def demo_index_out_of_range() -> None:
     """
@@ -109,35 +113,44 @@ def run_safety_demo(current_user) -> None:
     """
     Menú principal de demostraciones de seguridad.
     Permite al usuario ver ejemplos de cómo se previenen errores comunes.
+    Al salir del menú se registra un solo evento de auditoría con todas
+    las demostraciones ejecutadas, en lugar de uno por cada opción.
     """
-    while True:
-        print("\n" + "=" * 60)
-        print("=== Demostración de Seguridad ===")
-        print("=" * 60)
-        print("1) Ejemplo de índice fuera de rango (prevención de crashes)")
-        print("2) Ejemplo de límite máximo de tickets (overflow lógico)")
-        print("3) Prevención de SQL Injection")
-        print("0) Volver al menú anterior")
-        print("=" * 60)
-        
-        option = input_int_in_range("Elige una opción: ", 0, 3)
-        
-        if option == 0:
-            break
-        elif option == 1:
-            demo_index_out_of_range()
-        elif option == 2:
-            demo_ticket_limit()
-        elif option == 3:
-            demo_sql_injection_prevention()
-        
-        # Registrar en logs que se ejecutó una demo
-        if option > 0:
+    demo_events: List[int] = []
+    
+    try:
+        while True:
+            print("\n" + "=" * 60)
+            print("=== Demostración de Seguridad ===")
+            print("=" * 60)
+            print("1) Ejemplo de índice fuera de rango (prevención de crashes)")
+            print("2) Ejemplo de límite máximo de tickets (overflow lógico)")
+            print("3) Prevención de SQL Injection")
+            print("0) Volver al menú anterior")
+            print("=" * 60)
+            
+            option = input_int_in_range("Elige una opción: ", 0, 3)
+            
+            if option == 0:
+                break
+            elif option == 1:
+                demo_index_out_of_range()
+            elif option == 2:
+                demo_ticket_limit()
+            elif option == 3:
+                demo_sql_injection_prevention()
+            
+            # Anotar la demo ejecutada (con límite para no crecer sin fin)
+            if len(demo_events) < MAX_DEMO_EVENTS:
+                demo_events.append(option)
+    finally:
+        # Registrar en logs las demos de la sesión, aunque se salga con Ctrl+C
+        if demo_events:
             log_action(
                 user=current_user,
-                action="SECURITY_DEMO",
+                action="SECURITY_DEMO_SESSION",
                 entity="demo",
-                entity_id=f"demo_{option}",
+                entity_id="session",
                 status="success",
-                details=f"Usuario ejecutó demostración de seguridad opción {option}"
+                details=f"Usuario ejecutó demostraciones de seguridad: {json.dumps(demo_events)}"
             )
@@ -1,21 +1,79 @@
 """
 Módulo para el manejo seguro de contraseñas.
-Usa SHA-256 para hashear las contraseñas antes de guardarlas.
+Usa scrypt con una sal aleatoria por usuario para hashear las contraseñas
+antes de guardarlas.
 """
+import base64
 import hashlib
+import hmac
+import os
 
+# Parámetros de costo de scrypt (n debe ser potencia de 2)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_DKLEN = 32
+SALT_SIZE = 16
 
-def hash_password(password: str) -> str:
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int, dklen: int) -> bytes:
+    """
+    Deriva la clave de una contraseña usando scrypt.
+    """
+    return hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=2 * 128 * r * n,
+        dklen=dklen,
+    )
+
+
+def hash_password(password: str, salt: bytes | None = None) -> str:
     """
-    Convierte una contraseña en texto plano a un hash SHA-256.
-    Devuelve el hash en formato hexadecimal.
+    Convierte una contraseña en texto plano a un hash scrypt con sal.
+    Devuelve un string con el formato "scrypt$n$r$p$sal_b64$hash_b64"
+    para poder verificarlo después sin guardar la sal por separado.
     """
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+    if salt is None:
+        salt = os.urandom(SALT_SIZE)
+    
+    derived = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P, SCRYPT_DKLEN)
+    salt_b64 = base64.b64encode(salt).decode("ascii")
+    hash_b64 = base64.b64encode(derived).decode("ascii")
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt_b64}${hash_b64}"
 
 
 def verify_password(password: str, password_hash: str) -> bool:
     """
     Verifica si una contraseña en texto plano coincide con un hash guardado.
+    Acepta también los hashes SHA-256 antiguos (hexadecimal sin sal) para
+    que los usuarios registrados antes del cambio puedan seguir entrando.
     Retorna True si coinciden, False si no.
     """
-    return hash_password(password) == password_hash
+    if not password_hash.startswith("scrypt$"):
+        # Formato antiguo: SHA-256 en hexadecimal. Se comparan bytes porque
+        # compare_digest lanza TypeError con un str que no sea ASCII
+        legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(legacy.encode("ascii"), password_hash.encode("utf-8"))
+    
+    try:
+        _, n, r, p, salt_b64, hash_b64 = password_hash.split("$")
+        salt = base64.b64decode(salt_b64)
+        expected = base64.b64decode(hash_b64)
+        derived = _scrypt(password, salt, int(n), int(r), int(p), len(expected))
+    except (ValueError, TypeError):
+        # Hash mal formado: nunca debe permitir el acceso
+        return False
+    
+    return hmac.compare_digest(derived, expected)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """
+    Indica si el hash está en el formato SHA-256 antiguo y conviene
+    reemplazarlo por uno scrypt la próxima vez que se conozca la contraseña.
+    """
+    return not password_hash.startswith("scrypt$")
@@ -2,8 +2,33 @@
 Módulo para manejar la lectura y escritura de archivos de datos.
 Usa formato JSON por línea para guardar registros de forma simple.
 """
+import atexit
 import os
 import json
+import sys
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+# Bloqueo de archivos entre procesos: fcntl en Linux/macOS, msvcrt en Windows
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+# orjson es opcional: si está instalado se usa para leer y serializar,
+# que es bastante más rápido; si no, se usa el módulo json estándar.
+# Ambos producen JSON compacto en UTF-8, así que los archivos quedan iguales.
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+    
+    def _dumps(record: dict) -> bytes:
+        # Sin espacios tras "," y ":", igual que orjson
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 # Detectar la raíz del proyecto (donde está app.py)
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -14,19 +39,124 @@ LOGS_DIR = os.path.join(PROJECT_ROOT, "logs")
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# Buffer de lectura grande: menos llamadas al sistema en archivos grandes
+READ_BUFFER_SIZE = 1 << 20
 
-def read_json_lines(path: str) -> list[dict]:
+# Archivos de bloqueo abiertos, uno por ruta. Se abren la primera vez y se
+# reutilizan, así cada escritura solo paga el flock y no abrir y cerrar.
+# flock no separa a los hilos que comparten el mismo archivo abierto,
+# por eso cada ruta tiene además su propio threading.Lock.
+_LOCK_FILES: dict[str, tuple[BinaryIO, threading.RLock]] = {}
+_LOCK_FILES_LOCK = threading.Lock()
+
+# Cuántas veces anidadas tiene tomado el bloqueo de cada ruta el hilo dueño:
+# solo la primera toma el flock y solo la última lo suelta
+_LOCK_DEPTH: dict[str, int] = {}
+
+
+def _lock_file(f) -> None:
     """
-    Lee un archivo donde cada línea es un JSON independiente.
-    Ignora líneas vacías y líneas con errores de formato.
+    Toma el bloqueo exclusivo del archivo, esperando si otro proceso lo tiene.
     """
-    records = []
-    
-    # Si el archivo no existe, devolver lista vacía
+    if sys.platform == "win32":
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(f) -> None:
+    """
+    Libera el bloqueo tomado con _lock_file.
+    """
+    if sys.platform == "win32":
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _lock_file_for(path: str) -> tuple[BinaryIO, threading.RLock]:
+    """
+    Devuelve el archivo de bloqueo (path + ".lock") de esa ruta y el lock
+    entre hilos que lo acompaña, abriéndolo la primera vez.
+    """
+    with _LOCK_FILES_LOCK:
+        entry = _LOCK_FILES.get(path)
+        if entry is None:
+            entry = (open(path + ".lock", "a+b"), threading.RLock())
+            _LOCK_FILES[path] = entry
+        return entry
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Bloqueo exclusivo entre procesos para escribir en path.
+    Se bloquea un archivo aparte (path + ".lock") porque write_json_lines
+    reemplaza el archivo de datos y un bloqueo sobre él se perdería.
+    Evita que dos instancias del CLI mezclen o pisen sus escrituras.
+    Se puede anidar: quien necesita leer, decidir y escribir sin que otro
+    proceso se meta en medio toma el bloqueo alrededor de todo, y las
+    escrituras de este módulo lo vuelven a tomar sin esperar.
+    """
+    f, thread_lock = _lock_file_for(path)
+    with thread_lock:
+        depth = _LOCK_DEPTH.get(path, 0)
+        if depth == 0:
+            _lock_file(f)
+        _LOCK_DEPTH[path] = depth + 1
+        try:
+            yield
+        finally:
+            _LOCK_DEPTH[path] = depth
+            if depth == 0:
+                _unlock_file(f)
+
+
+def _close_lock_files() -> None:
+    """
+    Cierra los archivos de bloqueo. Se ejecuta al salir del programa.
+    """
+    with _LOCK_FILES_LOCK:
+        for f, _ in _LOCK_FILES.values():
+            f.close()
+        _LOCK_FILES.clear()
+
+
+atexit.register(_close_lock_files)
+
+
+def _forget_lock_files() -> None:
+    """
+    En un proceso hijo creado con fork los archivos de bloqueo heredados
+    comparten el flock con el padre y no lo excluirían: se descartan para
+    que el hijo abra los suyos. Cerrarlos aquí no suelta el bloqueo
+    del padre, que sigue teniendo su copia abierta.
+    """
+    for f, _ in _LOCK_FILES.values():
+        f.close()
+    _LOCK_FILES.clear()
+    _LOCK_DEPTH.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_lock_files)
+
+
+def iter_json_lines(path: str) -> Iterator[dict]:
+    """
+    Recorre un archivo donde cada línea es un JSON independiente,
+    devolviendo un registro a la vez sin cargar todo el archivo en memoria.
+    Ignora líneas vacías, líneas con errores de formato y valores que no
+    sean objetos JSON.
+    """
+    # Si el archivo no existe, no hay nada que devolver
     if not os.path.exists(path):
-        return records
+        return
     
-    with open(path, "r", encoding="utf-8") as f:
+    # Se lee en bytes: ambos parsers aceptan bytes UTF-8 directamente
+    with open(path, "rb", buffering=READ_BUFFER_SIZE) as f:
         for line in f:
             line = line.strip()
             # Ignorar líneas vacías
@@ -34,32 +164,52 @@ def read_json_lines(path: str) -> list[dict]:
                 continue
             try:
                 # Intentar convertir la línea a dict
-                record = json.loads(line)
-                records.append(record)
-            except json.JSONDecodeError:
-                # Si hay error, simplemente ignorar esa línea
+                record = _loads(line)
+            except ValueError:
+                # Si hay error (JSON o UTF-8 inválido), ignorar esa línea
                 continue
-    
-    return records
+            if isinstance(record, dict):
+                yield record
 
 
-def write_json_lines(path: str, records: list[dict]) -> None:
+def encode_json_line(record: dict) -> bytes:
+    """
+    Convierte un registro a JSON compacto en bytes UTF-8, sin el salto de línea.
+    """
+    return _dumps(record)
+
+
+def read_json_lines(path: str) -> list[dict]:
+    """
+    Lee un archivo donde cada línea es un JSON independiente.
+    Ignora líneas vacías y líneas con errores de formato.
+    """
+    return list(iter_json_lines(path))
+
+
+def write_json_lines(path: str, records: list[dict], fsync: bool = False) -> None:
     """
     Escribe una lista de registros al archivo, cada uno en su propia línea.
     Usa un archivo temporal para evitar corrupción si algo falla.
+    Con fsync=True espera a que los datos lleguen al disco antes de
+    reemplazar el archivo (más lento, solo para datos que no se pueden perder).
     """
     temp_path = path + ".tmp"
     
-    # Escribir primero al archivo temporal
-    with open(temp_path, "w", encoding="utf-8") as f:
-        for record in records:
-            json_line = json.dumps(record, ensure_ascii=False)
-            f.write(json_line + "\n")
+    # Serializar todo en memoria para escribirlo con una sola llamada
+    payload = b"".join([_dumps(record) + b"\n" for record in records])
     
-    # Reemplazar el archivo original con el temporal
-    if os.path.exists(path):
-        os.remove(path)
-    os.rename(temp_path, path)
+    with file_lock(path):
+        # Escribir primero al archivo temporal
+        with open(temp_path, "wb") as f:
+            f.write(payload)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        
+        # Reemplazar el archivo original con el temporal
+        # os.replace es atómico: nunca queda un momento sin el archivo original
+        os.replace(temp_path, path)
 
 
 def append_json_line(path: str, record: dict) -> None:
@@ -67,6 +217,16 @@ def append_json_line(path: str, record: dict) -> None:
     Agrega un nuevo registro al final del archivo.
     Si el archivo no existe, lo crea.
     """
-    with open(path, "a", encoding="utf-8") as f:
-        json_line = json.dumps(record, ensure_ascii=False)
-        f.write(json_line + "\n")
+    json_line = _dumps(record) + b"\n"
+    with file_lock(path), open(path, "ab") as f:
+        f.write(json_line)
+
+
+def append_json_lines(path: str, records: list[dict]) -> None:
+    """
+    Agrega varios registros al final del archivo con una sola escritura.
+    Si el archivo no existe, lo crea.
+    """
+    payload = b"".join([_dumps(record) + b"\n" for record in records])
+    with file_lock(path), open(path, "ab") as f:
+        f.write(payload)
@@ -3,21 +3,43 @@ Módulo de gestión de tickets de soporte.
 Maneja todas las operaciones CRUD sobre tickets con control de acceso por rol.
 """
 import os
-from datetime import datetime
-from typing import List, Optional
+import sys
+from typing import List, Optional, Tuple
 
-from .storage import DATA_DIR, read_json_lines, write_json_lines
+from .storage import DATA_DIR, append_json_line, file_lock, iter_json_lines, write_json_lines
 from .validation import input_int_in_range, sanitize_text_field, safe_input
 from .logger import log_action
+from .timeutil import now_iso_z
 from models.ticket import Ticket
 from models.user import User
 
 # Ruta del archivo donde se guardan los tickets
 TICKETS_FILE = os.path.join(DATA_DIR, "tickets.txt")
 
-# Valores válidos para status y priority
-STATUS_VALUES = ("open", "in_progress", "closed")
-PRIORITY_VALUES = ("low", "medium", "high")
+# Valores válidos para status y priority (frozenset: búsqueda por hash)
+STATUS_VALUES = frozenset({"open", "in_progress", "closed"})
+PRIORITY_VALUES = frozenset({"low", "medium", "high"})
+
+# Transiciones de estado permitidas: (estado actual, estado nuevo)
+# Un ticket cerrado no puede reabrirse.
+STATUS_TRANSITIONS = frozenset({
+    ("open", "in_progress"),
+    ("open", "closed"),
+    ("in_progress", "closed"),
+})
+
+# Campos que no pueden faltar ni estar vacíos en un registro de ticket
+_REQUIRED_TICKET_FIELDS = ("id", "owner_id", "title")
+
+# Tickets en memoria y la marca (mtime en ns, tamaño) del archivo al cargarlos.
+# Mientras el archivo no cambie no se vuelve a leer ni a parsear.
+# _INDEX permite buscar por ID sin recorrer la lista, _BY_OWNER agrupa los
+# tickets de cada usuario y _MAX_ID es el ID más alto.
+_TICKETS: Optional[List[Ticket]] = None
+_TICKETS_STAMP: Optional[Tuple[int, int]] = None
+_INDEX: dict[str, Ticket] = {}
+_BY_OWNER: dict[str, List[Ticket]] = {}
+_MAX_ID: int = 0
 
 
 def is_valid_status(status: str) -> bool:
@@ -34,66 +56,145 @@ def is_valid_priority(priority: str) -> bool:
     return priority in PRIORITY_VALUES
 
 
-def _load_tickets() -> List[Ticket]:
+def _tickets_file_stamp() -> Optional[Tuple[int, int]]:
+    """
+    Devuelve la fecha de modificación (en nanosegundos) y el tamaño del
+    archivo de tickets, o None si todavía no existe.
+    """
+    try:
+        st = os.stat(TICKETS_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _set_cache(tickets: List[Ticket], stamp: Optional[Tuple[int, int]]) -> None:
+    """
+    Guarda la lista en memoria y reconstruye los índices por ID y por dueño
+    y el ID más alto en una sola pasada.
+    """
+    global _TICKETS, _TICKETS_STAMP, _INDEX, _BY_OWNER, _MAX_ID
+    
+    index = {}
+    by_owner = {}
+    max_id = 0
+    for ticket in tickets:
+        index[ticket.id] = ticket
+        by_owner.setdefault(ticket.owner_id, []).append(ticket)
+        # Los IDs que no son números se ignoran (isdecimal garantiza que int() funcione)
+        if ticket.id.isdecimal() and int(ticket.id) > max_id:
+            max_id = int(ticket.id)
+    
+    _TICKETS = tickets
+    _TICKETS_STAMP = stamp
+    _INDEX = index
+    _BY_OWNER = by_owner
+    _MAX_ID = max_id
+
+
+def _refresh_cache_if_stale() -> None:
     """
-    Carga todos los tickets desde el archivo.
-    Ignora registros que estén incompletos o con errores.
+    Vuelve a leer el archivo de tickets solo si cambió desde la última carga.
     """
-    records = read_json_lines(TICKETS_FILE)
+    stamp = _tickets_file_stamp()
+    if _TICKETS is not None and stamp == _TICKETS_STAMP:
+        return
+    
     tickets = []
     
-    for record in records:
-        try:
-            ticket = Ticket.from_dict(record)
-            # Verificar que los campos obligatorios no estén vacíos
-            if ticket.id and ticket.owner_id and ticket.title:
-                tickets.append(ticket)
-        except Exception:
-            # Si hay algún problema al crear el Ticket, ignorarlo
+    # Se recorre el archivo línea a línea sin crear antes la lista de dicts
+    for record in iter_json_lines(TICKETS_FILE):
+        # Verificar que los campos obligatorios no estén vacíos
+        # antes de crear el Ticket (más barato que capturar excepciones)
+        if not all(record.get(field) for field in _REQUIRED_TICKET_FIELDS):
             continue
+        tickets.append(Ticket.from_dict(record))
     
-    return tickets
+    _set_cache(tickets, stamp)
 
 
 def _save_tickets(tickets: List[Ticket]) -> None:
     """
     Guarda la lista completa de tickets al archivo.
+    Actualiza la copia en memoria para no tener que releer lo que se acaba de escribir.
     """
     records = [ticket.to_dict() for ticket in tickets]
     write_json_lines(TICKETS_FILE, records)
+    _set_cache(list(tickets), _tickets_file_stamp())
 
 
-def _next_ticket_id(tickets: List[Ticket]) -> str:
+def _append_ticket(ticket: Ticket) -> None:
+    """
+    Agrega un ticket nuevo al final del archivo sin reescribir los demás,
+    y lo suma a la copia en memoria.
+    Le asigna el siguiente ID libre con el archivo bloqueado, para que dos
+    procesos que crean tickets a la vez no reciban el mismo ID.
+    """
+    global _TICKETS_STAMP, _MAX_ID
+    
+    with file_lock(TICKETS_FILE):
+        # Se pone al día la copia antes de escribir y se actualiza la marca
+        # después, para que nuestra propia escritura no provoque una recarga
+        ticket.id = _next_ticket_id()
+        append_json_line(TICKETS_FILE, ticket.to_dict())
+        _TICKETS_STAMP = _tickets_file_stamp()
+        
+        _TICKETS.append(ticket)
+        _INDEX[ticket.id] = ticket
+        _BY_OWNER.setdefault(ticket.owner_id, []).append(ticket)
+        _MAX_ID = int(ticket.id)
+
+
+def _remove_ticket(ticket_id: str) -> None:
+    """
+    Elimina un ticket y reescribe el archivo con los tickets restantes.
+    Relee, modifica y guarda con el archivo bloqueado, para no borrar
+    tickets que otro proceso haya agregado mientras tanto.
+    Se filtra la lista completa (no el índice por ID) para que otros
+    registros con el mismo ID no se pierdan en silencio.
+    """
+    with file_lock(TICKETS_FILE):
+        _refresh_cache_if_stale()
+        target = _INDEX.get(ticket_id)
+        _save_tickets([t for t in _TICKETS if t is not target])
+
+
+def _update_ticket_record(ticket: Ticket) -> None:
+    """
+    Guarda los cambios de un ticket ya existente.
+    Relee, modifica y guarda con el archivo bloqueado, para no pisar
+    los tickets que otro proceso haya creado mientras se editaba.
+    Se reemplaza el registro dentro de la lista completa (no se rehace
+    desde el índice por ID) para conservar los registros con ID repetido.
+    """
+    with file_lock(TICKETS_FILE):
+        _refresh_cache_if_stale()
+        current = _INDEX.get(ticket.id)
+        if current is None:
+            # Otro proceso lo eliminó mientras se editaba: se vuelve a agregar
+            tickets = _TICKETS + [ticket]
+        else:
+            tickets = [ticket if t is current else t for t in _TICKETS]
+        _save_tickets(tickets)
+
+
+def _next_ticket_id() -> str:
     """
     Calcula el siguiente ID disponible para un nuevo ticket.
     Si no hay tickets, devuelve "1".
     """
-    if not tickets:
-        return "1"
-    
-    # Buscar el ID más alto y sumarle 1
-    max_id = 0
-    for ticket in tickets:
-        try:
-            ticket_id_int = int(ticket.id)
-            if ticket_id_int > max_id:
-                max_id = ticket_id_int
-        except ValueError:
-            # Si el ID no es un número, ignorarlo
-            continue
-    
-    return str(max_id + 1)
+    _refresh_cache_if_stale()
+    return str(_MAX_ID + 1)
 
 
-def _find_ticket_by_id(ticket_id: str, tickets: List[Ticket]) -> Optional[Ticket]:
+def _find_ticket_by_id(ticket_id: str) -> Optional[Ticket]:
     """
-    Busca un ticket por su ID.
+    Busca un ticket por su ID usando el índice en memoria,
+    sin reconstruir la lista completa de tickets.
     Devuelve None si no lo encuentra.
     """
-    for ticket in tickets:
-        if ticket.id == ticket_id:
-            return ticket
-    return None
+    _refresh_cache_if_stale()
+    return _INDEX.get(ticket_id)
 
 
 def create_ticket(current_user: User) -> None:
@@ -125,11 +226,10 @@ def create_ticket(current_user: User) -> None:
         return
     
     # Crear el ticket
-    tickets = _load_tickets()
-    now = datetime.utcnow().isoformat() + "Z"
+    now = now_iso_z()
     
     new_ticket = Ticket(
-        id=_next_ticket_id(tickets),
+        id="",  # Se asigna al guardar, con el archivo bloqueado
         owner_id=current_user.id,
         title=title,
         description=description,
@@ -140,9 +240,8 @@ def create_ticket(current_user: User) -> None:
         updated_at=now,
     )
     
-    # Guardar
-    tickets.append(new_ticket)
-    _save_tickets(tickets)
+    # Guardar (solo se agrega una línea al archivo)
+    _append_ticket(new_ticket)
     
     print(f"\n✓ Ticket #{new_ticket.id} creado exitosamente.")
     
@@ -164,25 +263,32 @@ def list_tickets(current_user: User) -> None:
     """
     print("\n--- Lista de tickets ---")
     
-    tickets = _load_tickets()
+    _refresh_cache_if_stale()
     
-    # Filtrar según el rol
+    # Elegir los tickets según el rol (solo se leen, no hace falta copiarlos)
     if current_user.role == "user":
-        # Los usuarios solo ven sus propios tickets
-        tickets = [t for t in tickets if t.owner_id == current_user.id]
-    # Los agentes ven todos los tickets
+        # Los usuarios solo ven sus propios tickets, sacados del índice por dueño
+        tickets = _BY_OWNER.get(current_user.id, [])
+    else:
+        # Los agentes ven todos los tickets
+        tickets = _TICKETS
     
     if not tickets:
         print("No hay tickets para mostrar.")
         return
     
-    # Mostrar tabla de tickets
-    print(f"\n{'ID':<5} {'Título':<30} {'Estado':<15} {'Prioridad':<10} {'Dueño':<10} {'Asignado':<10}")
-    print("-" * 90)
-    
+    # Armar la tabla completa y mostrarla con una sola escritura
+    lines = [
+        f"\n{'ID':<5} {'Título':<30} {'Estado':<15} {'Prioridad':<10} {'Dueño':<10} {'Asignado':<10}",
+        "-" * 90,
+    ]
     for ticket in tickets:
-        assignee_display = ticket.assignee_id if ticket.assignee_id else "Sin asignar"
-        print(f"{ticket.id:<5} {ticket.title[:28]:<30} {ticket.status:<15} {ticket.priority:<10} {ticket.owner_id:<10} {assignee_display:<10}")
+        lines.append(
+            f"{ticket.id:<5} {ticket.title[:28]:<30} {ticket.status:<15} {ticket.priority:<10} "
+            f"{ticket.owner_id:<10} {ticket.assignee_id or 'Sin asignar':<10}"
+        )
+    lines.append("")
+    sys.stdout.write("\n".join(lines))
 
 
 def view_ticket_detail(current_user: User) -> None:
@@ -194,8 +300,7 @@ def view_ticket_detail(current_user: User) -> None:
     
     ticket_id = safe_input("ID del ticket: ", field_type="id")
     
-    tickets = _load_tickets()
-    ticket = _find_ticket_by_id(ticket_id, tickets)
+    ticket = _find_ticket_by_id(ticket_id)
     
     if not ticket:
         print(f"Error: No existe un ticket con ID {ticket_id}.")
@@ -230,8 +335,7 @@ def update_ticket(current_user: User) -> None:
     
     ticket_id = safe_input("ID del ticket a editar: ", field_type="id")
     
-    tickets = _load_tickets()
-    ticket = _find_ticket_by_id(ticket_id, tickets)
+    ticket = _find_ticket_by_id(ticket_id)
     
     if not ticket:
         print(f"Error: No existe un ticket con ID {ticket_id}.")
@@ -317,21 +421,16 @@ def update_ticket(current_user: User) -> None:
                 print("Error: Estado inválido.")
                 continue
             
-            # Validar transiciones de estado
-            valid_transition = False
-            
-            if ticket.status == "open" and new_status in ["in_progress", "closed"]:
-                valid_transition = True
-            elif ticket.status == "in_progress" and new_status == "closed":
-                valid_transition = True
-            elif ticket.status == new_status:
+            if ticket.status == new_status:
                 print("El ticket ya tiene ese estado.")
                 continue
-            elif ticket.status == "closed":
+            
+            if ticket.status == "closed":
                 print("Error: Un ticket cerrado no puede reabrirse.")
                 continue
             
-            if valid_transition:
+            # Validar transiciones de estado con la tabla de permitidas
+            if (ticket.status, new_status) in STATUS_TRANSITIONS:
                 ticket.status = new_status
                 changes_made = True
                 print("✓ Estado actualizado.")
@@ -349,8 +448,8 @@ def update_ticket(current_user: User) -> None:
     # Si hubo cambios, guardar y registrar en logs
     if changes_made:
         # Actualizar timestamp
-        ticket.updated_at = datetime.utcnow().isoformat() + "Z"
-        _save_tickets(tickets)
+        ticket.updated_at = now_iso_z()
+        _update_ticket_record(ticket)
         print("\n✓ Ticket actualizado exitosamente.")
         
         # Registrar cambios importantes en logs
@@ -401,8 +500,7 @@ def delete_ticket(current_user: User) -> None:
     
     ticket_id = safe_input("ID del ticket a eliminar: ", field_type="id")
     
-    tickets = _load_tickets()
-    ticket = _find_ticket_by_id(ticket_id, tickets)
+    ticket = _find_ticket_by_id(ticket_id)
     
     if not ticket:
         print(f"Error: No existe un ticket con ID {ticket_id}.")
@@ -422,8 +520,7 @@ def delete_ticket(current_user: User) -> None:
         return
     
     # Eliminar el ticket
-    tickets = [t for t in tickets if t.id != ticket_id]
-    _save_tickets(tickets)
+    _remove_ticket(ticket_id)
     
     print(f"\n✓ Ticket #{ticket_id} eliminado exitosamente.")
     
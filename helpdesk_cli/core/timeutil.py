@@ -0,0 +1,25 @@
+"""
+Módulo con utilidades de fecha y hora.
+Genera los timestamps UTC en formato ISO que usan los registros y el log.
+"""
+import time
+
+# Último segundo formateado y su texto "YYYY-MM-DDTHH:MM:SS"
+_last_second: tuple[int, str] = (-1, "")
+
+
+def now_iso_z() -> str:
+    """
+    Devuelve la hora UTC actual en formato ISO con microsegundos y "Z",
+    por ejemplo "2025-11-26T15:30:45.123456Z".
+    Reutiliza la parte de fecha y hora mientras no cambie el segundo,
+    así solo se formatea una vez por segundo aunque haya muchos eventos.
+    """
+    global _last_second
+    
+    seconds, nanos = divmod(time.time_ns(), 1_000_000_000)
+    cached_second, prefix = _last_second
+    if seconds != cached_second:
+        prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+        _last_second = (seconds, prefix)
+    return f"{prefix}.{nanos // 1000:06d}Z"
@@ -2,9 +2,41 @@
 Módulo para validar las entradas del usuario.
 Asegura que los datos sean correctos antes de procesarlos.
 """
+import codecs
+import getpass
 import re
 import sys
-import msvcrt
+
+# msvcrt solo existe en Windows; en Linux/macOS se usa getpass
+if sys.platform == "win32":
+    import msvcrt
+
+# Patrones compilados una sola vez al importar el módulo.
+# \A y \Z (en lugar de ^ y $) evitan aceptar un salto de línea al final.
+_USERNAME_RE = re.compile(r"\A[A-Za-z0-9._]{3,30}\Z")
+_USERNAME_CHARS_RE = re.compile(r"\A[A-Za-z0-9._]+\Z")
+_CHOICE_RE = re.compile(r"\A[a-z_]+\Z")
+
+# Roles permitidos (frozenset: búsqueda por hash)
+_ROLE_VALUES = frozenset({"user", "agent"})
+
+# Tabla para cambiar los saltos de línea por espacios en una sola pasada
+_NEWLINE_TABLE = str.maketrans({"\n": " ", "\r": " "})
+
+# Tipos de campo de safe_input en los que se rechazan patrones peligrosos
+_STRICT_FIELD_TYPES = frozenset({"username", "id", "choice"})
+
+# Patrones comunes de SQL injection
+_DANGEROUS_PATTERNS = (
+    "';", '";', '--', '/*', '*/', 'xp_', 'sp_',
+    'exec', 'execute', 'select', 'insert', 'update',
+    'delete', 'drop', 'create', 'alter', 'union',
+    'script', '<script', 'javascript:', 'onerror='
+)
+
+# Todos los patrones en una sola expresión: se recorre el texto una vez
+# en lugar de una vez por patrón, y sin crear una copia en minúsculas
+_DANGEROUS_RE = re.compile("|".join(map(re.escape, _DANGEROUS_PATTERNS)), re.IGNORECASE)
 
 
 def is_valid_username(username: str) -> bool:
@@ -14,14 +46,12 @@ def is_valid_username(username: str) -> bool:
     - Entre 3 y 30 caracteres
     - Solo letras, números, puntos y guiones bajos
     """
-    if not username or len(username) < 3 or len(username) > 30:
+    # Descartes baratos antes de usar la expresión regular
+    if not 3 <= len(username) <= 30 or not username.isascii():
         return False
     
     # Solo permitir letras, números, punto y guion bajo
-    if not re.match(r'^[a-zA-Z0-9._]+$', username):
-        return False
-    
-    return True
+    return _USERNAME_RE.match(username) is not None
 
 
 def is_valid_password(password: str) -> bool:
@@ -35,7 +65,7 @@ def is_valid_role(role: str) -> bool:
     """
     Valida que el rol sea uno de los permitidos: user o agent.
     """
-    return role in ["user", "agent"]
+    return role in _ROLE_VALUES
 
 
 def contains_sql_injection_patterns(text: str) -> bool:
@@ -43,19 +73,7 @@ def contains_sql_injection_patterns(text: str) -> bool:
     Detecta patrones comunes de SQL injection en texto.
     Retorna True si encuentra algo sospechoso.
     """
-    # Patrones comunes de SQL injection
-    dangerous_patterns = [
-        "';", '";', '--', '/*', '*/', 'xp_', 'sp_',
-        'exec', 'execute', 'select', 'insert', 'update', 
-        'delete', 'drop', 'create', 'alter', 'union',
-        'script', '<script', 'javascript:', 'onerror='
-    ]
-    
-    text_lower = text.lower()
-    for pattern in dangerous_patterns:
-        if pattern in text_lower:
-            return True
-    return False
+    return _DANGEROUS_RE.search(text) is not None
 
 
 def input_int_in_range(prompt: str, min_value: int, max_value: int) -> int:
@@ -101,8 +119,10 @@ def sanitize_text_field(text: str, max_length: int = 300, allow_sql_keywords: bo
     # Eliminar espacios al inicio y final
     text = text.strip()
     
-    # Reemplazar saltos de línea por espacios para mantener el formato JSON
-    text = text.replace("\n", " ").replace("\r", " ")
+    # Reemplazar saltos de línea por espacios para mantener el formato JSON.
+    # Solo se recorre el texto para reemplazar si de verdad tiene alguno.
+    if "\n" in text or "\r" in text:
+        text = text.translate(_NEWLINE_TABLE)
     
     # Limitar la longitud máxima
     if len(text) > max_length:
@@ -128,7 +148,7 @@ def safe_input(prompt: str, field_type: str = "text") -> str:
             return value
         
         # Detectar patrones sospechosos en entradas críticas
-        if field_type in ["username", "id", "choice"]:
+        if field_type in _STRICT_FIELD_TYPES:
             if contains_sql_injection_patterns(value):
                 print("⚠ Entrada rechazada: contiene caracteres o patrones no permitidos.")
                 print("Por favor usa solo caracteres válidos.")
@@ -136,7 +156,7 @@ def safe_input(prompt: str, field_type: str = "text") -> str:
         
         # Validaciones específicas por tipo
         if field_type == "username":
-            if not re.match(r'^[a-zA-Z0-9._]+$', value):
+            if not _USERNAME_CHARS_RE.match(value):
                 print("Solo se permiten letras, números, puntos y guiones bajos.")
                 continue
         
@@ -146,7 +166,7 @@ def safe_input(prompt: str, field_type: str = "text") -> str:
                 continue
         
         elif field_type == "choice":
-            if not re.match(r'^[a-z_]+$', value):
+            if not _CHOICE_RE.match(value):
                 print("Solo se permiten letras minúsculas y guiones bajos.")
                 continue
         
@@ -157,9 +177,18 @@ def input_password(prompt: str = "Contraseña: ") -> str:
     """
     Solicita una contraseña mostrando asteriscos en lugar de los caracteres.
     Funciona en Windows mostrando * por cada carácter escrito.
+    En Linux/macOS usa getpass, que no muestra nada mientras se escribe.
     """
+    if sys.platform != "win32":
+        return getpass.getpass(prompt)
+    
     print(prompt, end='', flush=True)
-    password = ""
+    
+    # Los caracteres se guardan en una lista y se unen una sola vez al final.
+    # El decodificador incremental junta los bytes de un carácter que ocupa
+    # más de uno (por ejemplo "ñ"), así el backspace borra el carácter completo.
+    chars = []
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
     
     while True:
         # Leer un carácter sin mostrarlo
@@ -172,21 +201,21 @@ def input_password(prompt: str = "Contraseña: ") -> str:
         
         # Backspace (código 8) borra el último carácter
         elif char == b'\x08':
-            if len(password) > 0:
-                password = password[:-1]
+            decoder.reset()
+            if chars:
+                chars.pop()
                 # Borrar el último asterisco en pantalla
                 sys.stdout.write('\b \b')
                 sys.stdout.flush()
         
         # Caracteres normales
         else:
-            try:
-                # Decodificar y agregar a la contraseña
-                password += char.decode('utf-8')
-                sys.stdout.write('*')
+            # Devuelve "" mientras el carácter esté incompleto;
+            # los bytes inválidos se ignoran
+            text = decoder.decode(char)
+            if text:
+                chars.extend(text)
+                sys.stdout.write('*' * len(text))
                 sys.stdout.flush()
-            except:
-                # Ignorar caracteres que no se puedan decodificar
-                pass
     
-    return password
+    return "".join(chars)
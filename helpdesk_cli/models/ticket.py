@@ -5,7 +5,7 @@ Contiene toda la información relacionada con las solicitudes de ayuda.
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class Ticket:
     """
     Representa un ticket de soporte con toda su información.
@@ -5,7 +5,7 @@ Usa dataclass para simplificar la definición de la clase.
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     """
     Representa un usuario con toda su información.